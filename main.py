@@ -2,6 +2,7 @@ import win32com.client
 from typing import List, Dict, Any, Set, Tuple
 import time
 import re
+import asyncio
 import textwrap
 from colorama import Fore, Style
 from datetime import datetime, timedelta
@@ -9,22 +10,55 @@ import hashlib
 import pythoncom
 import logging
 import pandas as pd
+import xlsxwriter
+from dateutil import parser as dateutil_parser
 import json
+import orjson
 import os
 from langchain_community.llms import Ollama
 from langchain.prompts import PromptTemplate
 from langchain.schema import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnablePassthrough, RunnableLambda
+from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.exceptions import OutputParserException
+from langchain_community.cache import SQLiteCache
+from langchain_core.globals import set_llm_cache
 import concurrent.futures
 from functools import lru_cache
 import threading
+import itertools
+import queue
+import atexit
 
 # Importações para banco de dados
-from sqlalchemy import create_engine, Column, String, DateTime, Float, Text, Date, Numeric
+from sqlalchemy import create_engine, event, Column, String, DateTime, Float, Text, Date, Numeric
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import IntegrityError
 
+# Mensagens por e-mail em DEBUG e por lote em INFO; banners continuam como print colorido
+logger = logging.getLogger(__name__)
+
+def configurar_log():
+    """Define o nível só do logger deste módulo a partir de NIVEL_LOG (padrão WARNING)
+    
+    NIVEL_LOG=INFO mostra o resumo de cada lote e NIVEL_LOG=DEBUG o andamento de cada e-mail;
+    o logger raiz não é alterado, então bibliotecas (Ollama, SQLAlchemy) não passam a registrar.
+    """
+    nome_nivel = (os.environ.get("NIVEL_LOG") or "WARNING").strip().upper()
+    nivel = logging.getLevelName(nome_nivel)
+    if not isinstance(nivel, int):
+        print(f"{Fore.YELLOW}NIVEL_LOG inválido ({nome_nivel}), usando WARNING{Style.RESET_ALL}")
+        nivel = logging.WARNING
+    
+    logger.setLevel(nivel)
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.propagate = False
+
 # Configuração do banco de dados
 Base = declarative_base()
 
@@ -52,38 +86,30 @@ class ExportacaoDB(Base):
     data_processamento = Column(DateTime, default=datetime.now)
     data_atualizacao = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
-# Configuração de cache para evitar recarregamentos desnecessários
-@lru_cache(maxsize=1)
-def inicializar_ollama():
-    """Inicializa o modelo Ollama com cache"""
-    try:
-        llm = Ollama(
-            model="llama3:8b-instruct-fp16", 
-            temperature=0.1,
-            num_predict=800,
-            num_thread=8,  # Aumenta threads para processamento paralelo
-            num_gpu=1      # Utiliza GPU se disponível
-        )
-        print(f"{Fore.GREEN}✓ Ollama inicializado com otimizações{Style.RESET_ALL}")
-        return llm
-    except Exception as e:
-        print(f"{Fore.RED}Falha ao inicializar Ollama: {e}{Style.RESET_ALL}")
-        return None
-# Template pré-compilado para melhor performance
-def criar_template_json():
-    """Cria o template para extração de dados em formato JSON específico"""
-    template = """
-    ANALISE E EXTRAIA APENAS OS DADOS DESTE E-MAIL ESPECÍFICO sobre exportação:
+class CacheExtracaoDB(Base):
+    """Tabela com o resultado da extração por hash do e-mail (assunto + corpo)"""
+    __tablename__ = 'llm_cache'
+    
+    body_hash = Column(String(32), primary_key=True)
+    json_payload = Column(Text, nullable=False)
 
-    TEXTO ORIGINAL:
-    {texto}
+class MetaDB(Base):
+    """Estado do processamento (chave/valor), gravado junto com os lotes"""
+    __tablename__ = 'meta'
+    
+    key = Column(String(50), primary_key=True)
+    value = Column(Text)
+
+# Instruções fixas enviadas como system prompt: o Ollama reaproveita esse prefixo entre as chamadas
+PROMPT_SISTEMA_EXTRACAO = textwrap.dedent("""
+    Você extrai dados de e-mails sobre programação de exportação.
 
     INSTRUÇÕES ESTRITAS:
-    1. Extraia APENAS informações deste e-mail específico
+    1. Extraia APENAS informações do e-mail recebido
     2. NÃO combine, resuma ou inclua informações de outros e-mails
     3. Retorne SEMPRE em formato JSON válido com a estrutura EXATA abaixo
     4. Se um campo não existir no e-mail, deixe como string vazia ""
-    5. Se não encontrar dados de exportação, retorne: {{"status": "SEM_DADOS_EXPORTACAO"}}
+    5. Se não encontrar dados de exportação, retorne: {"status": "SEM_DADOS_EXPORTACAO"}
 
     INSTRUÇÕES ESPECÍFICAS PARA DATAS:
     - Para datas, use sempre o formato YYYY-MM-DD (ex: 2024-07-10)
@@ -91,7 +117,7 @@ def criar_template_json():
     - Se a data não for clara, deixe como string vazia ""
 
     ESTRUTURA JSON OBRIGATÓRIA:
-    {{
+    {
       "data_embarque": "",
       "planta_carregamento": "",
       "Tipo_de_embarque": "",
@@ -108,16 +134,54 @@ def criar_template_json():
       "Transportador_Ter": "",
       "ETA": "",
       "Valor_Pedido_(R$)": ""
-    }}
+    }
+""").strip()
 
-    IMPORTANTE: Processe apenas este e-mail individualmente.
+# Modelo quantizado 4-bit: metade da leitura de pesos por token vs. fp16
+MODELO_OLLAMA = "llama3:8b-instruct-q4_K_M"
 
-    JSON:
-    """
+# Texto enviado por e-mail; regras e estrutura JSON ficam no system prompt
+TEMPLATE_EXTRACAO = "ASSUNTO: {assunto}\n\nEMAIL:\n{texto}\n\nJSON:"
+
+# Versão do prompt derivada do próprio texto: alterar as instruções invalida o cache de extração
+VERSAO_PROMPT_EXTRACAO = hashlib.blake2b(
+    f"{PROMPT_SISTEMA_EXTRACAO}\n{TEMPLATE_EXTRACAO}".encode(), digest_size=8
+).hexdigest()
+
+# Configuração de cache para evitar recarregamentos desnecessários
+@lru_cache(maxsize=1)
+def inicializar_ollama():
+    """Inicializa o modelo Ollama com cache"""
+    try:
+        # Respostas idênticas (mesmo prompt, modelo e parâmetros) são lidas do disco
+        set_llm_cache(SQLiteCache(database_path=".langchain_cache.db"))
+    except Exception as e:
+        # Sem o cache (ex.: diretório somente leitura) o Ollama continua disponível
+        logger.warning("Cache de respostas do Ollama indisponível: %s", e)
     
-    return PromptTemplate.from_template(template)
+    try:
+        llm = Ollama(
+            model=MODELO_OLLAMA,
+            system=PROMPT_SISTEMA_EXTRACAO,
+            temperature=0.1,
+            num_predict=800,
+            num_thread=8,  # Aumenta threads para processamento paralelo
+            num_gpu=1      # Utiliza GPU se disponível
+        )
+        print(f"{Fore.GREEN}✓ Ollama inicializado com otimizações{Style.RESET_ALL}")
+        return llm
+    except Exception as e:
+        print(f"{Fore.RED}Falha ao inicializar Ollama: {e}{Style.RESET_ALL}")
+        return None
+# Template pré-compilado para melhor performance (instância única)
+@lru_cache(maxsize=1)
+def criar_template_json():
+    """Cria o template por e-mail; regras e estrutura JSON ficam no system prompt"""
+    return PromptTemplate.from_template(TEMPLATE_EXTRACAO)
 
 # Compila regex patterns uma vez para melhor performance
+# A ordem importa: cada padrão é aplicado sobre o resultado do anterior (ex.: "Original Message.*?-----"
+# consome o cabeçalho antes de "-----Original Message-----.*?$", preservando o e-mail encaminhado)
 PADROES_REMOCAO = [
     re.compile(r"Att,.*?minervafoods\.com.*?(?=\n\s*\n|\Z)", re.DOTALL|re.IGNORECASE),
     re.compile(r"Esta mensagem é endereçada exclusivamente.*?privilegiadas.*?(?=\n\s*\n|\Z)", re.DOTALL|re.IGNORECASE),
@@ -125,46 +189,50 @@ PADROES_REMOCAO = [
     re.compile(r"Skype:.*?\n", re.IGNORECASE),
     re.compile(r"Telefone:.*?\n", re.IGNORECASE),
     re.compile(r"\bRamal:.*?\n", re.IGNORECASE),
-    re.compile(r"\n{3,}"),
-    re.compile(r"http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+"),
-    re.compile(r"\[image:.*?\]"),
-    re.compile(r"<.*?>"),
+    re.compile(r"https?://\S+"),
+    re.compile(r"\[image:[^\]\n]*\]"),
+    re.compile(r"<[^>\n]*>"),
     re.compile(r"\b\d{3}[-.]?\d{3}[-.]?\d{4}\b"),
-    re.compile(r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b"),
+    re.compile(r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b"),
     re.compile(r"^.*?escreveu:$", re.MULTILINE),
     re.compile(r"Em \d{1,2} de [a-z]+ de \d{4}.*?escreveu:$", re.DOTALL|re.IGNORECASE),
     re.compile(r"Original Message.*?-----", re.DOTALL|re.IGNORECASE),
     re.compile(r"-----Original Message-----.*?$", re.DOTALL|re.IGNORECASE)
 ]
 
-def processar_com_ollama_json(texto: str, llm, prompt_template) -> Dict[str, Any]:
-    """Processa o texto usando Ollama para extração de dados em JSON"""
-    if not texto.strip() or len(texto.strip()) < 50:
-        return {"status": "TEXTO_INSUFICIENTE"}
-    try:
-        # Chain otimizada
-        resultado = prompt_template.invoke({"texto": texto})
-        resultado = llm.invoke(resultado.text)
-        # Parse rápido do JSON
+_json_parser = JsonOutputParser()
+
+def _extrair_json_balanceado(texto: str) -> Dict[str, Any]:
+    """Localiza o primeiro objeto JSON completo (chaves balanceadas) dentro do texto"""
+    decoder = json.JSONDecoder()
+    for abertura in re.finditer(r'\{', texto):
         try:
-            dados_json = json.loads(resultado.strip())
-            if isinstance(dados_json, dict) and "status" not in dados_json:
-                return dados_json
-            else:
-                return {"status": "SEM_DADOS_EXPORTACAO"}
-                
+            objeto, _ = decoder.raw_decode(texto, abertura.start())
         except json.JSONDecodeError:
-            # Busca rápida por JSON no texto
-            json_match = re.search(r'\{[^{}]*\}', resultado, re.DOTALL)
-            if json_match:
-                try:
-                    return json.loads(json_match.group())
-                except:
-                    return {"erro": "JSON_INVALIDO", "raw_text": resultado[:200]}
-            return {"erro": "JSON_INVALIDO", "raw_text": resultado[:200]}
-    except Exception as e:
-        print(f"{Fore.YELLOW}Erro no Ollama: {e}{Style.RESET_ALL}")
-        return {"erro": f"ERRO_PROCESSAMENTO: {str(e)}"}
+            continue
+        if isinstance(objeto, dict):
+            return objeto
+    return None
+
+def _parse_one(raw: str) -> Dict[str, Any]:
+    """Converte a resposta bruta do Ollama no dicionário de exportação"""
+    try:
+        # Aceita blocos ```json e fecha JSON truncado pelo limite de tokens
+        dados_json = _json_parser.parse(raw)
+    except OutputParserException:
+        # JSON cercado por texto livre
+        dados_json = _extrair_json_balanceado(raw)
+        if dados_json is None:
+            return {"erro": "JSON_INVALIDO", "raw_text": raw[:200]}
+    
+    if isinstance(dados_json, dict) and "status" not in dados_json:
+        return dados_json
+    else:
+        return {"status": "SEM_DADOS_EXPORTACAO"}
+
+def criar_chain_extracao(llm, prompt_template):
+    """Monta a chain prompt -> Ollama -> dicionário de exportação"""
+    return prompt_template | llm | RunnableLambda(_parse_one)
 
 def limpar_texto_rapido(email_body: str) -> str:
     """Remove assinaturas e informações redundantes de forma otimizada"""
@@ -175,105 +243,246 @@ def limpar_texto_rapido(email_body: str) -> str:
     for padrao in PADROES_REMOCAO:
         texto_limpo = padrao.sub("", texto_limpo)
     
-    # Remove linhas vazias e espaços excessivos de forma eficiente
+    # Remove linhas vazias (inclusive sequências de 3+ quebras) e espaços excessivos de forma eficiente
     texto_limpo = re.sub(r'\n\s*\n', '\n\n', texto_limpo)
+    # Normaliza espaços para que e-mails repetidos gerem o mesmo prompt (chave do cache)
+    texto_limpo = re.sub(r'[ \t]+', ' ', texto_limpo)
+    texto_limpo = re.sub(r' *\n *', '\n', texto_limpo)
     texto_limpo = texto_limpo.strip()
     
     return textwrap.dedent(texto_limpo)
 
-def processar_email_json_rapido(email_body: str, llm, prompt_template_json, assunto: str) -> Dict[str, Any]:
-    """Processa o e-mail de forma otimizada"""
-    if not email_body:
-        return {"status": "EMAIL_VAZIO"}
-        
-    try:
-        # Limpeza rápida
-        texto_limpo = limpar_texto_rapido(email_body)
-        
-        if len(texto_limpo) > 80:
-            contexto = f"ASSUNTO: {assunto}\n\n{texto_limpo}"
-            return processar_com_ollama_json(contexto, llm, prompt_template_json)
+# Chamadas simultâneas ao Ollama dentro de um lote (o lote inteiro é enviado de uma vez)
+MAXIMO_CHAMADAS_OLLAMA_SIMULTANEAS = 10
+
+async def processar_emails_json_lote_async(emails: List[Tuple[str, str]], chain_extracao) -> List[Dict[str, Any]]:
+    """Processa vários e-mails (corpo, assunto) com chamadas simultâneas ao Ollama"""
+    resultados: List[Dict[str, Any]] = [None] * len(emails)
+    
+    # Limpeza rápida de todos os corpos antes de acionar o modelo (alguns ms por e-mail: um
+    # pool de processos custaria mais para subir no Windows do que o lote inteiro leva aqui)
+    textos_limpos = [limpar_texto_rapido(corpo) for corpo, _ in emails]
+    
+    indices_validos = []
+    inputs = []
+    for i, ((corpo, assunto), texto_limpo) in enumerate(zip(emails, textos_limpos)):
+        if not corpo:
+            resultados[i] = {"status": "EMAIL_VAZIO"}
+        elif len(texto_limpo) > 80:
+            indices_validos.append(i)
+            inputs.append({"assunto": assunto, "texto": texto_limpo})
         else:
-            return {"status": "TEXTO_MUITO_CURTO"}
-            
-    except Exception as e:
-        print(f"{Fore.YELLOW}Erro no processamento: {e}{Style.RESET_ALL}")
-        return {"erro": f"ERRO_PROCESSAMENTO: {str(e)}"}
+            resultados[i] = {"status": "TEXTO_MUITO_CURTO"}
+    
+    if not inputs:
+        return resultados
+    
+    # Chain montada uma vez na inicialização; o Ollama agrupa as requisições simultâneas
+    semaforo = asyncio.Semaphore(MAXIMO_CHAMADAS_OLLAMA_SIMULTANEAS)
+    
+    async def _invocar(entrada: Dict[str, str]) -> Dict[str, Any]:
+        async with semaforo:
+            return await chain_extracao.ainvoke(entrada)
+    
+    respostas = await asyncio.gather(*[_invocar(entrada) for entrada in inputs], return_exceptions=True)
+    
+    for i, resposta in zip(indices_validos, respostas):
+        if isinstance(resposta, Exception):
+            logger.warning("Erro no Ollama: %s", resposta)
+            resultados[i] = {"erro": f"ERRO_PROCESSAMENTO: {str(resposta)}"}
+        else:
+            resultados[i] = resposta
+    
+    return resultados
+
+# Namespace MAPI compartilhado: COM é inicializado uma vez por processo
+_outlook = None
 
 def inicializar_outlook():
-    """Inicializa o Outlook com segurança"""
+    """Inicializa o Outlook com segurança (chamadas seguintes reutilizam a mesma conexão)"""
+    global _outlook
+    if _outlook is not None:
+        return _outlook
     try:
         pythoncom.CoInitialize()
-        outlook = win32com.client.Dispatch("Outlook.Application").GetNamespace("MAPI")
+        atexit.register(pythoncom.CoUninitialize)
+        _outlook = win32com.client.Dispatch("Outlook.Application").GetNamespace("MAPI")
         print(f"{Fore.GREEN}✓ Outlook inicializado{Style.RESET_ALL}")
-        return outlook
+        return _outlook
     except Exception as e:
         print(f"{Fore.RED}Falha ao inicializar Outlook: {e}{Style.RESET_ALL}")
         return None
 
+# Filtro DASL aplicado pelo próprio Outlook, só por assunto: datas no filtro são interpretadas
+# conforme a localidade do Windows (ex.: pt-BR) e podem fazer o Restrict voltar vazio sem erro.
+# O corte por data é feito na varredura abaixo, com os itens em ordem decrescente.
+FILTRO_DASL_EXPORTACAO = "@SQL=\"urn:schemas:httpmail:subject\" LIKE '%PROGRAMA%EXPORTA%'"
+
+# O monitor repete a busca a cada ciclo: a recusa do SetColumns é avisada só na primeira vez
+_aviso_set_columns_exibido = False
+
 def obter_emails_exportacao_rapido(pasta, ultima_verificacao: datetime = None):
     """Obtém e-mails de forma otimizada"""
+    global _aviso_set_columns_exibido
     try:
-        emails_exportacao = []
-        items = pasta.Items
+        ids_exportacao = []
+        
+        # Restringe os itens no provedor MAPI em vez de percorrer a pasta inteira via COM
+        items = pasta.Items.Restrict(FILTRO_DASL_EXPORTACAO)
         
         # Ordena por data recebimento (mais recentes primeiro)
         items.Sort("[ReceivedTime]", True)
         
+        # Na varredura só as colunas usadas no filtro são carregadas; o item completo vem depois pelo EntryID
+        try:
+            items.SetColumns("Subject, ReceivedTime, EntryID")
+        except Exception as e:
+            if _aviso_set_columns_exibido:
+                logger.debug("SetColumns não aceito pelo Outlook (%s), lendo itens completos", e)
+            else:
+                print(f"{Fore.YELLOW}SetColumns não aceito pelo Outlook ({e}), lendo itens completos{Style.RESET_ALL}")
+                _aviso_set_columns_exibido = True
+        
         for email in items:
+            if ultima_verificacao:
+                data_email = getattr(email, 'ReceivedTime', None)
+                if not data_email:
+                    continue
+                try:
+                    # Itens em ordem decrescente: a partir daqui tudo é anterior à última verificação
+                    if data_email.replace(tzinfo=None) < ultima_verificacao:
+                        break
+                except Exception as e:
+                    logger.warning("Data de recebimento inválida, e-mail ignorado: %s", e)
+                    continue
+            
             assunto = getattr(email, 'Subject', '').upper()
             
             if "PROGRAMAÇÃO EXPORTAÇÃO" in assunto or "PROGRAMACAO EXPORTACAO" in assunto:
-                if ultima_verificacao:
-                    data_email = getattr(email, 'ReceivedTime', None)
-                    if data_email:
-                        try:
-                            if data_email.replace(tzinfo=None) >= ultima_verificacao:
-                                emails_exportacao.append(email)
-                        except:
-                            emails_exportacao.append(email)
-                else:
-                    emails_exportacao.append(email)
+                ids_exportacao.append(email.EntryID)
         
-        return emails_exportacao
+        # Abre o item completo (corpo, remetente) apenas dos e-mails selecionados
+        sessao, id_store = pasta.Session, pasta.StoreID
+        return [sessao.GetItemFromID(entry_id, id_store) for entry_id in ids_exportacao]
         
     except Exception as e:
         print(f"{Fore.RED}Erro ao obter e-mails: {e}{Style.RESET_ALL}")
         return []
 
-# Cache para JSON existente
+def _construir_indice_ordens(emails: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Monta o índice ordem -> posição na lista de e-mails (mantido só em memória)"""
+    indice = {}
+    for i, email in enumerate(emails):
+        ordem = email["dados_exportacao"].get("Ordem", "").strip()
+        if ordem:
+            indice.setdefault(ordem, i)
+    return indice
+
+# Cache para JSON existente (write-through; invalidado apenas por alteração externa do arquivo)
 _json_cache = None
-_json_cache_time = 0
+_json_cache_mtime = None
+
+# Registros ainda não gravados no JSONL e total de linhas já gravadas no arquivo
+_json_pendentes: List[Dict[str, Any]] = []
+_jsonl_linhas = 0
+
+# Linhas obsoletas (substituídas por atualizações) que disparam a compactação do JSONL
+LIMITE_LINHAS_OBSOLETAS_JSONL = 1000
+
+def _caminho_jsonl(nome_arquivo: str) -> str:
+    """Arquivo JSONL (um e-mail por linha) correspondente ao JSON informado"""
+    return os.path.splitext(nome_arquivo)[0] + ".jsonl"
+
+def _estrutura_json_vazia() -> Dict[str, Any]:
+    """Estrutura agregada usada em memória"""
+    return {
+        "metadata": {
+            "processamento_timestamp": datetime.now().isoformat(),
+            "total_emails_processados": 0,
+            "emails_com_dados": 0,
+            "ultima_atualizacao": datetime.now().isoformat(),
+            "ordens_unicas": []
+        },
+        "emails": [],
+        "_ordem_index": {}
+    }
+
+def _aplicar_registro_jsonl(dados: Dict[str, Any], registro: Dict[str, Any]):
+    """Aplica uma linha do JSONL (inclusão ou atualização por ordem) aos dados em memória"""
+    if registro.get("_op") == "update":
+        indice = dados["_ordem_index"].get(registro["ordem"], -1)
+        if indice != -1:
+            dados["emails"][indice] = registro["email"]
+            return
+        registro = registro["email"]
+    
+    dados["emails"].append(registro)
+    ordem = registro["dados_exportacao"].get("Ordem", "").strip()
+    if ordem:
+        dados["_ordem_index"].setdefault(ordem, len(dados["emails"]) - 1)
+
+def _mtime_arquivo(caminho: str):
+    """Data de modificação do arquivo, ou None se ele não existir"""
+    try:
+        return os.path.getmtime(caminho)
+    except OSError:
+        return None
+
+def _compactar_jsonl(caminho_jsonl: str, dados: Dict[str, Any]):
+    """Reescreve o JSONL com uma linha por e-mail, descartando as versões substituídas"""
+    global _jsonl_linhas, _json_cache_mtime
+    
+    caminho_temp = caminho_jsonl + ".tmp"
+    with open(caminho_temp, 'wb') as f:
+        for email in dados["emails"]:
+            f.write(orjson.dumps(email) + b'\n')
+    os.replace(caminho_temp, caminho_jsonl)
+    _jsonl_linhas = len(dados["emails"])
+    _json_cache_mtime = _mtime_arquivo(caminho_jsonl)
 
 def carregar_json_existente_rapido(nome_arquivo: str) -> Dict[str, Any]:
     """Carrega o JSON existente com cache"""
-    global _json_cache, _json_cache_time
+    global _json_cache, _json_cache_mtime, _jsonl_linhas
+    
+    caminho_jsonl = _caminho_jsonl(nome_arquivo)
+    mtime = _mtime_arquivo(caminho_jsonl)
     
-    current_time = time.time()
-    if _json_cache and current_time - _json_cache_time < 30:  # Cache por 30 segundos
+    # Só relê o arquivo se ele foi alterado por fora; com registros pendentes a memória é a única versão completa
+    if _json_cache and (_gravacao_json_pendente() or mtime == _json_cache_mtime):
         return _json_cache
     
     try:
+        if os.path.exists(caminho_jsonl):
+            # Lê o arquivo linha a linha aplicando inclusões e atualizações
+            dados = _estrutura_json_vazia()
+            linhas = 0
+            with open(caminho_jsonl, 'rb') as f:
+                for linha in f:
+                    if linha.strip():
+                        _aplicar_registro_jsonl(dados, orjson.loads(linha))
+                        linhas += 1
+            
+            # Metadados agregados são recalculados a partir dos e-mails
+            _atualizar_metadata_json(dados, set(dados["_ordem_index"]))
+            _jsonl_linhas = linhas
+            _json_cache = dados
+            _json_cache_mtime = mtime
+            return _json_cache
+        
         if os.path.exists(nome_arquivo):
-            with open(nome_arquivo, 'r', encoding='utf-8') as f:
-                _json_cache = json.load(f)
-                _json_cache_time = current_time
-                return _json_cache
+            # Formato antigo (arquivo JSON único): converte para JSONL na primeira carga
+            with open(nome_arquivo, 'rb') as f:
+                _json_cache = orjson.loads(f.read())
+                _json_cache["_ordem_index"] = _construir_indice_ordens(_json_cache["emails"])
+            _compactar_jsonl(caminho_jsonl, _json_cache)
+            return _json_cache
     except Exception as e:
         print(f"{Fore.YELLOW}Erro ao carregar JSON: {e}{Style.RESET_ALL}")
     
     # Retorna estrutura vazia
-    empty_data = {
-        "metadata": {
-            "processamento_timestamp": datetime.now().isoformat(),
-            "total_emails_processados": 0,
-            "emails_com_dados": 0,
-            "ultima_atualizacao": datetime.now().isoformat(),
-            "ordens_unicas": []
-        },
-        "emails": []
-    }
+    empty_data = _estrutura_json_vazia()
     _json_cache = empty_data
+    _json_cache_mtime = mtime
     return empty_data
 
 def obter_ordens_unicas_existentes_rapido(nome_arquivo: str) -> Set[str]:
@@ -288,10 +497,10 @@ def verificar_duplicidade_ordem_rapida(dados_exportacao: Dict[str, Any], ordens_
 
 def encontrar_email_por_ordem(dados_existentes: Dict[str, Any], ordem: str) -> Tuple[int, Dict[str, Any]]:
     """Encontra um email existente pela ordem e retorna seu índice e dados"""
-    for i, email in enumerate(dados_existentes["emails"]):
-        if email["dados_exportacao"].get("Ordem", "").strip() == ordem:
-            return i, email
-    return -1, None
+    if "_ordem_index" not in dados_existentes:
+        dados_existentes["_ordem_index"] = _construir_indice_ordens(dados_existentes["emails"])
+    i = dados_existentes["_ordem_index"].get(ordem, -1)
+    return i, dados_existentes["emails"][i] if i >= 0 else None
 
 def comparar_datas_email(data_nova_str: str, data_existente_str: str) -> bool:
     """Compara duas datas de email e retorna True se a nova para ser mais recente"""
@@ -309,8 +518,142 @@ def comparar_datas_email(data_nova_str: str, data_existente_str: str) -> bool:
 # Lock para escrita thread-safe
 _json_lock = threading.Lock()
 
-def salvar_json_incremental_rapido(nome_arquivo: str, email_processado: Dict[str, Any], ordens_existentes: Set[str]) -> Tuple[bool, Set[str]]:
-    """Salvamento incremental otimizado com substituição de dados mais recentes"""
+def _atualizar_metadata_json(dados_existentes: Dict[str, Any], ordens_existentes: Set[str]):
+    """Recalcula os metadados agregados do JSON"""
+    dados_existentes["metadata"]["ordens_unicas"] = list(ordens_existentes)
+    dados_existentes["metadata"]["total_emails_processados"] = len(dados_existentes["emails"])
+    dados_existentes["metadata"]["emails_com_dados"] = sum(
+        1 for email in dados_existentes["emails"] 
+        if email['dados_exportacao'].get('status') != 'SEM_DADOS_EXPORTACAO' and
+        not email['dados_exportacao'].get('erro')
+    )
+    dados_existentes["metadata"]["ultima_atualizacao"] = datetime.now().isoformat()
+
+# Fila do gravador único do JSONL: quem salva só enfileira, a thread gravadora escreve e faz fsync
+_fila_gravacao_json: "queue.Queue[Tuple[str, Dict[str, Any]]]" = queue.Queue()
+_gravador_json = None
+
+# Quantidade máxima de registros e espera máxima (segundos) por escrita do gravador
+MAXIMO_REGISTROS_GRAVACAO_JSON = 64
+ESPERA_GRAVACAO_JSON = 0.2
+
+def _gravacao_json_pendente() -> bool:
+    """Indica se há registros em memória ainda não gravados no JSONL"""
+    return bool(_json_pendentes) or _fila_gravacao_json.unfinished_tasks > 0
+
+def _serializar_registro_jsonl(registro: Dict[str, Any]) -> bytes:
+    """Uma linha do JSONL; valores que o orjson recusa (ex.: inteiro acima de 64 bits) vão pelo json padrão"""
+    try:
+        return orjson.dumps(registro) + b'\n'
+    except TypeError:
+        return json.dumps(registro, ensure_ascii=False, default=str).encode('utf-8') + b'\n'
+
+def _escrever_registros_jsonl(registros: List[Tuple[str, Dict[str, Any]]]):
+    """Anexa os registros ao JSONL em uma única escrita com fsync
+    
+    Registros que não puderem ser serializados ou gravados voltam para _json_pendentes.
+    """
+    global _jsonl_linhas, _json_cache_mtime
+    
+    por_arquivo: Dict[str, List[Dict[str, Any]]] = {}
+    for nome_arquivo, registro in registros:
+        por_arquivo.setdefault(_caminho_jsonl(nome_arquivo), []).append(registro)
+    
+    for caminho_jsonl, registros_arquivo in por_arquivo.items():
+        # Serializa registro a registro: um valor inválido não derruba o restante do bloco
+        linhas, nao_gravados = [], []
+        for registro in registros_arquivo:
+            try:
+                linhas.append(_serializar_registro_jsonl(registro))
+            except Exception as e:
+                print(f"{Fore.RED}Erro ao serializar registro do JSON, mantido pendente: {e}{Style.RESET_ALL}")
+                nao_gravados.append(registro)
+        
+        try:
+            if linhas:
+                with open(caminho_jsonl, 'ab') as f:
+                    f.write(b''.join(linhas))
+                    f.flush()
+                    os.fsync(f.fileno())
+        except OSError as e:
+            print(f"{Fore.RED}Erro ao salvar JSON, registros mantidos pendentes: {e}{Style.RESET_ALL}")
+            nao_gravados, linhas = list(registros_arquivo), []
+        
+        with _json_lock:
+            _json_pendentes.extend(nao_gravados)
+            _jsonl_linhas += len(linhas)
+            _json_cache_mtime = _mtime_arquivo(caminho_jsonl)
+            
+            # Compacta quando as versões substituídas passam do limite; só com a fila vazia,
+            # senão os registros ainda enfileirados seriam gravados em dobro
+            if (_json_cache and not _json_pendentes and _fila_gravacao_json.empty() and
+                    _jsonl_linhas - len(_json_cache["emails"]) > LIMITE_LINHAS_OBSOLETAS_JSONL):
+                _compactar_jsonl(caminho_jsonl, _json_cache)
+
+def _loop_gravacao_json():
+    """Thread gravadora: junta até 64 registros ou 200 ms de espera por escrita"""
+    while True:
+        registros = [_fila_gravacao_json.get()]
+        limite = time.monotonic() + ESPERA_GRAVACAO_JSON
+        while len(registros) < MAXIMO_REGISTROS_GRAVACAO_JSON:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                registros.append(_fila_gravacao_json.get(timeout=restante))
+            except queue.Empty:
+                break
+        
+        try:
+            _escrever_registros_jsonl(registros)
+        except Exception as e:
+            print(f"{Fore.RED}Erro ao salvar JSON: {e}{Style.RESET_ALL}")
+        finally:
+            for _ in registros:
+                _fila_gravacao_json.task_done()
+
+def _iniciar_gravador_json():
+    """Inicia a thread gravadora na primeira gravação"""
+    global _gravador_json
+    if _gravador_json is None:
+        _gravador_json = threading.Thread(target=_loop_gravacao_json, name="gravador-json", daemon=True)
+        _gravador_json.start()
+        atexit.register(aguardar_gravacao_json)
+
+def aguardar_gravacao_json():
+    """Bloqueia até a thread gravadora esvaziar a fila"""
+    _fila_gravacao_json.join()
+
+def _enfileirar_pendentes_jsonl(nome_arquivo: str, ordens_existentes: Set[str]):
+    """Envia os registros pendentes para a thread gravadora (chamar com _json_lock adquirido)"""
+    dados_existentes = carregar_json_existente_rapido(nome_arquivo)
+    
+    _iniciar_gravador_json()
+    for registro in _json_pendentes:
+        _fila_gravacao_json.put((nome_arquivo, registro))
+    _json_pendentes.clear()
+    
+    _atualizar_metadata_json(dados_existentes, ordens_existentes)
+
+def gravar_json_pendentes(nome_arquivo: str, ordens_existentes: Set[str]) -> bool:
+    """Envia para gravação os e-mails mesclados em memória desde a última gravação (uma vez por lote)"""
+    with _json_lock:
+        try:
+            if _json_pendentes:
+                _enfileirar_pendentes_jsonl(nome_arquivo, ordens_existentes)
+            return True
+            
+        except Exception as e:
+            print(f"{Fore.RED}Erro ao salvar JSON: {e}{Style.RESET_ALL}")
+            return False
+
+def salvar_json_incremental_rapido(nome_arquivo: str, email_processado: Dict[str, Any], ordens_existentes: Set[str], gravar_disco: bool = True) -> Tuple[bool, Set[str]]:
+    """Salvamento incremental otimizado com substituição de dados mais recentes
+    
+    Cada e-mail vira uma linha no JSONL (inclusão ou atualização por ordem). Com
+    gravar_disco=False a linha fica pendente até gravar_json_pendentes ao final do lote;
+    a escrita em disco é feita pela thread gravadora.
+    """
     global _json_cache  # Declaração global no início da função
     
     with _json_lock:  # Thread-safe
@@ -332,60 +675,52 @@ def salvar_json_incremental_rapido(nome_arquivo: str, email_processado: Dict[str
                     
                     # Verifica se o novo email é mais recente
                     if comparar_datas_email(data_nova_email, data_existente_email):
-                        print(f"{Fore.YELLOW}🔄 ATUALIZANDO: Ordem '{ordem}' com dados mais recentes{Style.RESET_ALL}")
+                        logger.debug("🔄 ATUALIZANDO: Ordem '%s' com dados mais recentes", ordem)
                         
                         # Substitui o email antigo pelo novo
                         dados_existentes["emails"][indice_existente] = email_processado
-                        
-                        # Atualiza metadados
-                        dados_existentes["metadata"]["ultima_atualizacao"] = datetime.now().isoformat()
-                        
-                        # Salva de forma otimizada
-                        with open(nome_arquivo, 'w', encoding='utf-8') as f:
-                            json.dump(dados_existentes, f, ensure_ascii=False, indent=2)
-                        
-                        # Atualiza cache
-                        _json_cache = dados_existentes
-                        
-                        return True, ordens_existentes
+                        _json_pendentes.append({"_op": "update", "ordem": ordem, "email": email_processado})
                     else:
-                        print(f"{Fore.YELLOW}⚠️  DUPLICIDADE: Ordem '{ordem}' já existe com dados mais recentes{Style.RESET_ALL}")
+                        logger.debug("⚠️  DUPLICIDADE: Ordem '%s' já existe com dados mais recentes", ordem)
                         return False, ordens_existentes
                 else:
-                    print(f"{Fore.YELLOW}⚠️  DUPLICIDADE: Ordem '{ordem}' já existe{Style.RESET_ALL}")
+                    logger.debug("⚠️  DUPLICIDADE: Ordem '%s' já existe", ordem)
                     return False, ordens_existentes
+            else:
+                # Se não é duplicidade ou se é uma ordem nova, adiciona normalmente
+                dados_existentes["emails"].append(email_processado)
+                _json_pendentes.append(email_processado)
+                
+                # Atualiza ordens e o índice se for nova
+                if ordem:
+                    ordens_existentes.add(ordem)
+                    dados_existentes["_ordem_index"].setdefault(ordem, len(dados_existentes["emails"]) - 1)
             
-            # Se não é duplicidade ou se é uma ordem nova, adiciona normalmente
-            dados_existentes["emails"].append(email_processado)
-            
-            # Atualiza ordens se for nova
-            if ordem:
-                ordens_existentes.add(ordem)
-                dados_existentes["metadata"]["ordens_unicas"] = list(ordens_existentes)
-            
-            # Atualiza metadados
-            total = len(dados_existentes["emails"])
-            dados_existentes["metadata"]["total_emails_processados"] = total
-            dados_existentes["metadata"]["emails_com_dados"] = sum(
-                1 for email in dados_existentes["emails"] 
-                if email['dados_exportacao'].get('status') != 'SEM_DADOS_EXPORTACAO' and
-                not email['dados_exportacao'].get('erro')
-            )
-            dados_existentes["metadata"]["ultima_atualizacao"] = datetime.now().isoformat()
-            
-            # Salva de forma otimizada
-            with open(nome_arquivo, 'w', encoding='utf-8') as f:
-                json.dump(dados_existentes, f, ensure_ascii=False, indent=2)
-            
-            # Atualiza cache
+            # Atualiza cache (write-through: a memória é sempre a versão mais recente)
             _json_cache = dados_existentes
             
+            if gravar_disco:
+                # Enfileira apenas o registro novo; a thread gravadora anexa ao arquivo
+                _enfileirar_pendentes_jsonl(nome_arquivo, ordens_existentes)
+            
             return True, ordens_existentes
             
         except Exception as e:
             print(f"{Fore.RED}Erro ao salvar JSON: {e}{Style.RESET_ALL}")
             return False, ordens_existentes
 
+# Formatos de data aceitos, na ordem de prioridade
+FORMATOS_DATA = [
+    '%Y-%m-%d',          # 2024-01-15
+    '%d/%m/%Y',          # 15/01/2024
+    '%d-%m-%Y',          # 15-01-2024
+    '%m/%d/%Y',          # 01/15/2024 (formato americano)
+    '%Y/%m/%d',          # 2024/01/15
+    '%d.%m.%Y',          # 15.01.2024
+    '%d %b %Y',          # 15 Jan 2024
+    '%d %B %Y',          # 15 January 2024
+]
+
 def converter_para_data(data_str):
     """
     Converte string para objeto date do Python
@@ -397,19 +732,7 @@ def converter_para_data(data_str):
     # Remove espaços e converte para string
     data_str = str(data_str).strip()
     
-    # Lista de formatos possíveis
-    formatos_data = [
-        '%Y-%m-%d',          # 2024-01-15
-        '%d/%m/%Y',          # 15/01/2024
-        '%d-%m-%Y',          # 15-01-2024
-        '%m/%d/%Y',          # 01/15/2024 (formato americano)
-        '%Y/%m/%d',          # 2024/01/15
-        '%d.%m.%Y',          # 15.01.2024
-        '%d %b %Y',          # 15 Jan 2024
-        '%d %B %Y',          # 15 January 2024
-    ]
-    
-    for formato in formatos_data:
+    for formato in FORMATOS_DATA:
         try:
             return datetime.strptime(data_str, formato).date()
         except ValueError:
@@ -417,28 +740,75 @@ def converter_para_data(data_str):
     
     # Se nenhum formato funcionar, tenta parser mais flexível
     try:
-        from dateutil import parser
-        return parser.parse(data_str, dayfirst=True).date()
+        return dateutil_parser.parse(data_str, dayfirst=True).date()
     except:
-        print(f"{Fore.YELLOW}⚠️  Não foi possível converter a data: '{data_str}'{Style.RESET_ALL}")
+        logger.warning("⚠️  Não foi possível converter a data: '%s'", data_str)
         return None
 
+def converter_datas_em_lote(valores: List[Any]) -> List[Any]:
+    """
+    Converte uma lista de strings em objetos date de forma vetorizada
+    Cada formato é aplicado com pd.to_datetime apenas aos valores ainda não convertidos;
+    o que sobrar passa pelo converter_para_data
+    """
+    serie = pd.Series(["" if valor is None else str(valor).strip() for valor in valores], dtype="object")
+    convertidas = pd.Series(pd.NaT, index=serie.index, dtype="datetime64[ns]")
+    pendentes = serie != ""
+    
+    for formato in FORMATOS_DATA:
+        if not pendentes.any():
+            break
+        tentativa = pd.to_datetime(serie[pendentes], format=formato, errors='coerce')
+        convertidas.loc[tentativa.index] = tentativa
+        pendentes &= convertidas.isna()
+    
+    resultado = [data.date() if not pd.isna(data) else None for data in convertidas]
+    
+    # Fallback (dateutil) somente para os valores que nenhum formato reconheceu
+    for i in pendentes[pendentes].index:
+        resultado[i] = converter_para_data(valores[i])
+    
+    return resultado
+
+# Tudo que não é dígito ou vírgula decimal (R$, pontos de milhar, espaços, etc.)
+_RE_NAO_NUMERICO = re.compile(r'[^\d,]')
+
 def converter_para_decimal(valor_str):
     """
     Converte string para valor decimal/número
     """
-    if not valor_str or pd.isna(valor_str) or valor_str == "":
+    if valor_str is None or valor_str == "" or pd.isna(valor_str):
         return None
     
-    try:
-        # Remove caracteres não numéricos (R$, pontos, espaços, etc.)
-        valor_limpo = re.sub(r'[^\d,]', '', str(valor_str))
-        valor_limpo = valor_limpo.replace(',', '.')
-        
-        return float(valor_limpo) if valor_limpo else None
-    except:
-        print(f"{Fore.YELLOW}⚠️  Não foi possível converter o valor: '{valor_str}'{Style.RESET_ALL}")
-        return None
+    # Valores já numéricos não passam pela limpeza (o ponto seria tratado como milhar);
+    # bool é subclasse de int, mas True/False não são valores de pedido
+    if isinstance(valor_str, (int, float)) and not isinstance(valor_str, bool):
+        return float(valor_str)
+    
+    valor_limpo = _RE_NAO_NUMERICO.sub('', str(valor_str)).replace(',', '.')
+    
+    # Aceita apenas dígitos com no máximo um separador decimal
+    if valor_limpo.replace('.', '', 1).isdigit():
+        return float(valor_limpo)
+    
+    if valor_limpo:
+        logger.warning("⚠️  Não foi possível converter o valor: '%s'", valor_str)
+    return None
+
+def _configurar_pragmas_sqlite(dbapi_conn, _):
+    """PRAGMAs aplicados a cada nova conexão: WAL permite leituras durante as gravações do monitor"""
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA cache_size=-64000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+def criar_engine_banco():
+    """Engine do banco de exportação com os PRAGMAs de desempenho"""
+    engine = create_engine('sqlite:///data/exportacao.db', echo=False)
+    event.listen(engine, "connect", _configurar_pragmas_sqlite)
+    return engine
 
 def inicializar_banco_dados():
     """Inicializa o banco de dados SQLite"""
@@ -447,7 +817,7 @@ def inicializar_banco_dados():
         os.makedirs('data', exist_ok=True)
         
         # Configuração do banco de dados
-        engine = create_engine('sqlite:///data/exportacao.db', echo=False)
+        engine = criar_engine_banco()
         Base.metadata.create_all(engine)
         
         Session = sessionmaker(bind=engine)
@@ -460,100 +830,157 @@ def inicializar_banco_dados():
         print(f"{Fore.RED}Erro ao inicializar banco de dados: {e}{Style.RESET_ALL}")
         return None, None
 
+def montar_registros_banco(lista_dados_exportacao: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Converte os dados extraídos dos e-mails em linhas da tabela dbCONTAINER"""
+    # Ignora registros sem dados válidos
+    validos = [
+        (dados_exportacao, dados_exportacao.get("Ordem", "").strip())
+        for dados_exportacao in lista_dados_exportacao
+        if not dados_exportacao.get("status") and not dados_exportacao.get("erro")
+        and dados_exportacao.get("Ordem", "").strip()
+    ]
+    
+    # Datas convertidas de uma vez por coluna
+    datas_embarque = converter_datas_em_lote([dados.get("data_embarque", "") for dados, _ in validos])
+    etas = converter_datas_em_lote([dados.get("ETA", "") for dados, _ in validos])
+    
+    return [
+        {
+            "id": hashlib.md5(ordem.encode()).hexdigest()[:50],
+            "data_embarque": data_embarque,
+            "planta_carregamento": dados_exportacao.get("planta_carregamento", ""),
+            "tipo_embarque": dados_exportacao.get("Tipo_de_embarque", ""),
+            "temperatura": dados_exportacao.get("Temperatura", ""),
+            "ordem": ordem,
+            "porto_saida": dados_exportacao.get("Porto_de_saida", ""),
+            "porto_chegada": dados_exportacao.get("Porto_de_chegada", ""),
+            "companhia": dados_exportacao.get("Companhia", ""),
+            "navio": dados_exportacao.get("Navio", ""),
+            "dline": dados_exportacao.get("DLine", ""),
+            "reserva_booking": dados_exportacao.get("Reserva_(Booking)", ""),
+            "id_autorizacao": dados_exportacao.get("ID_(autorização)", ""),
+            "resumo_embarque": dados_exportacao.get("Resumo_embarque", ""),
+            "transportador_ter": dados_exportacao.get("Transportador_Ter", ""),
+            "eta": eta,
+            "valor_pedido": converter_para_decimal(dados_exportacao.get("Valor_Pedido_(R$)", ""))
+        }
+        for (dados_exportacao, ordem), data_embarque, eta in zip(validos, datas_embarque, etas)
+    ]
+
+# Linhas por comando INSERT com vários VALUES (e valores por filtro IN): cada linha usa uma variável
+# por coluna e o SQLite aceita no máximo 32766 variáveis por comando (17 colunas x 500 linhas fica bem abaixo)
+TAMANHO_BLOCO_SQLITE = 500
+
+def upsert_registros_sqlite(session, registros: List[Dict[str, Any]], commit: bool = True) -> bool:
+    """Insere ou atualiza (ON CONFLICT por ordem) um lote de registros em uma única transação
+    
+    Com commit=False a gravação fica na transação aberta, confirmada por quem chamou.
+    """
+    if not registros:
+        return True
+    
+    # Uma mesma ordem só pode aparecer uma vez por comando; mantém a última do lote
+    registros_por_ordem = {registro["ordem"]: registro for registro in registros}
+    
+    try:
+        insert = sqlite_insert(ExportacaoDB)
+        colunas_atualizadas = {
+            coluna: insert.excluded[coluna]
+            for coluna in registros[0]
+            if coluna not in ("id", "ordem")
+        }
+        # onupdate da coluna não é aplicado em ON CONFLICT DO UPDATE
+        colunas_atualizadas["data_atualizacao"] = datetime.now()
+        
+        # Blocos de TAMANHO_BLOCO_SQLITE linhas, todos na mesma transação
+        linhas = list(registros_por_ordem.values())
+        for i in range(0, len(linhas), TAMANHO_BLOCO_SQLITE):
+            stmt = insert.values(linhas[i:i + TAMANHO_BLOCO_SQLITE]).on_conflict_do_update(
+                index_elements=["ordem"], set_=colunas_atualizadas
+            )
+            session.execute(stmt)
+        if commit:
+            session.commit()
+        
+        logger.info("✅ Banco atualizado: %d ordens gravadas no lote", len(registros_por_ordem))
+        return True
+        
+    except Exception as e:
+        session.rollback()
+        print(f"{Fore.RED}❌ Erro ao gravar lote no banco de dados: {e}{Style.RESET_ALL}")
+        return False
+
+def _hash_email(corpo: str, assunto: str) -> str:
+    """Chave do cache de extração: blake2b de 128 bits sobre modelo, versão do prompt, assunto e corpo"""
+    return hashlib.blake2b(
+        f"{MODELO_OLLAMA}\n{VERSAO_PROMPT_EXTRACAO}\n{assunto}\n{corpo}".encode(), digest_size=16
+    ).hexdigest()
+
+def buscar_cache_extracao(session, hashes: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Retorna as extrações já conhecidas para os hashes informados"""
+    try:
+        linhas = session.query(CacheExtracaoDB).filter(CacheExtracaoDB.body_hash.in_(set(hashes))).all()
+        return {linha.body_hash: orjson.loads(linha.json_payload) for linha in linhas}
+    except Exception as e:
+        print(f"{Fore.YELLOW}Erro ao consultar cache de extração: {e}{Style.RESET_ALL}")
+        return {}
+
+def salvar_cache_extracao(session, extracoes: Dict[str, Dict[str, Any]], commit: bool = True):
+    """Grava as novas extrações no cache (INSERT OR IGNORE)"""
+    if not extracoes:
+        return
+    try:
+        linhas = [
+            {"body_hash": body_hash, "json_payload": orjson.dumps(dados).decode()}
+            for body_hash, dados in extracoes.items()
+        ]
+        for i in range(0, len(linhas), TAMANHO_BLOCO_SQLITE):
+            stmt = sqlite_insert(CacheExtracaoDB).values(
+                linhas[i:i + TAMANHO_BLOCO_SQLITE]
+            ).on_conflict_do_nothing(index_elements=["body_hash"])
+            session.execute(stmt)
+        if commit:
+            session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f"{Fore.YELLOW}Erro ao gravar cache de extração: {e}{Style.RESET_ALL}")
+
 def sincronizar_json_para_banco(nome_arquivo_json: str, session):
     """Sincroniza dados do JSON para o banco de dados com tratamento de tipos"""
     try:
         # Carrega dados do JSON
         dados_json = carregar_json_existente_rapido(nome_arquivo_json)
         
-        # Contadores para estatísticas
-        total_inseridos = 0
-        total_atualizados = 0
-        total_ignorados = 0
-        total_erros = 0
+        # Converte todos os e-mails em linhas da tabela (a última ocorrência de cada ordem prevalece)
+        registros = montar_registros_banco([email.get("dados_exportacao", {}) for email in dados_json["emails"]])
+        total_ignorados = len(dados_json["emails"]) - len(registros)
+        registros_por_ordem = {registro["ordem"]: registro for registro in registros}
+        
+        # Uma consulta (por bloco de TAMANHO_BLOCO_SQLITE ordens) separa inserções de atualizações
+        ordens = list(registros_por_ordem)
+        ordens_no_banco = set()
+        for i in range(0, len(ordens), TAMANHO_BLOCO_SQLITE):
+            ordens_no_banco.update(
+                ordem for (ordem,) in session.query(ExportacaoDB.ordem).filter(ExportacaoDB.ordem.in_(ordens[i:i + TAMANHO_BLOCO_SQLITE]))
+            )
         
-        for email in dados_json["emails"]:
-            dados_exportacao = email.get("dados_exportacao", {})
-            
-            # Pula registros sem dados válidos
-            if dados_exportacao.get("status") == "SEM_DADOS_EXPORTACAO" or dados_exportacao.get("erro"):
-                total_ignorados += 1
-                continue
-            
-            ordem = dados_exportacao.get("Ordem", "").strip()
-            if not ordem:
-                total_ignorados += 1
-                continue
-            
-            try:
-                # Converter dados para tipos corretos
-                data_embarque = converter_para_data(dados_exportacao.get("data_embarque", ""))
-                eta = converter_para_data(dados_exportacao.get("ETA", ""))
-                valor_pedido = converter_para_decimal(dados_exportacao.get("Valor_Pedido_(R$)", ""))
-                
-                # Verifica se a ordem já existe no banco
-                registro_existente = session.query(ExportacaoDB).filter_by(ordem=ordem).first()
-                
-                if registro_existente:
-                    # Atualiza registro existente
-                    registro_existente.data_embarque = data_embarque
-                    registro_existente.planta_carregamento = dados_exportacao.get("planta_carregamento", "")
-                    registro_existente.tipo_embarque = dados_exportacao.get("Tipo_de_embarque", "")
-                    registro_existente.temperatura = dados_exportacao.get("Temperatura", "")
-                    registro_existente.porto_saida = dados_exportacao.get("Porto_de_saida", "")
-                    registro_existente.porto_chegada = dados_exportacao.get("Porto_de_chegada", "")
-                    registro_existente.companhia = dados_exportacao.get("Companhia", "")
-                    registro_existente.navio = dados_exportacao.get("Navio", "")
-                    registro_existente.dline = dados_exportacao.get("DLine", "")
-                    registro_existente.reserva_booking = dados_exportacao.get("Reserva_(Booking)", "")
-                    registro_existente.id_autorizacao = dados_exportacao.get("ID_(autorização)", "")
-                    registro_existente.resumo_embarque = dados_exportacao.get("Resumo_embarque", "")
-                    registro_existente.transportador_ter = dados_exportacao.get("Transportador_Ter", "")
-                    registro_existente.eta = eta
-                    registro_existente.valor_pedido = valor_pedido
-                    
-                    total_atualizados += 1
-                    print(f"{Fore.YELLOW}🔄 Atualizando ordem no banco: {ordem}{Style.RESET_ALL}")
-                    
-                else:
-                    # Cria novo registro
-                    novo_registro = ExportacaoDB(
-                        id=hashlib.md5(ordem.encode()).hexdigest()[:50],
-                        data_embarque=data_embarque,
-                        planta_carregamento=dados_exportacao.get("planta_carregamento", ""),
-                        tipo_embarque=dados_exportacao.get("Tipo_de_embarque", ""),
-                        temperatura=dados_exportacao.get("Temperatura", ""),
-                        ordem=ordem,
-                        porto_saida=dados_exportacao.get("Porto_de_saida", ""),
-                        porto_chegada=dados_exportacao.get("Porto_de_chegada", ""),
-                        companhia=dados_exportacao.get("Companhia", ""),
-                        navio=dados_exportacao.get("Navio", ""),
-                        dline=dados_exportacao.get("DLine", ""),
-                        reserva_booking=dados_exportacao.get("Reserva_(Booking)", ""),
-                        id_autorizacao=dados_exportacao.get("ID_(autorização)", ""),
-                        resumo_embarque=dados_exportacao.get("Resumo_embarque", ""),
-                        transportador_ter=dados_exportacao.get("Transportador_Ter", ""),
-                        eta=eta,
-                        valor_pedido=valor_pedido
-                    )
-                    
-                    session.add(novo_registro)
-                    total_inseridos += 1
-                    print(f"{Fore.GREEN}✅ Inserindo nova ordem no banco: {ordem}{Style.RESET_ALL}")
-            
-            except Exception as e:
-                total_erros += 1
-                print(f"{Fore.RED}❌ Erro ao processar ordem {ordem}: {e}{Style.RESET_ALL}")
-                continue
+        agora = datetime.now()
+        registros_inserir = [registro for ordem, registro in registros_por_ordem.items() if ordem not in ordens_no_banco]
+        registros_atualizar = [
+            {**registro, "data_atualizacao": agora}
+            for ordem, registro in registros_por_ordem.items() if ordem in ordens_no_banco
+        ]
+        
+        session.bulk_insert_mappings(ExportacaoDB, registros_inserir)
+        session.bulk_update_mappings(ExportacaoDB, registros_atualizar)
         
         # Commit das alterações
         session.commit()
         
         print(f"{Fore.CYAN}📊 Sincronização concluída:{Style.RESET_ALL}")
-        print(f"   Inseridos: {total_inseridos}")
-        print(f"   Atualizados: {total_atualizados}")
+        print(f"   Inseridos: {len(registros_inserir)}")
+        print(f"   Atualizados: {len(registros_atualizar)}")
         print(f"   Ignorados: {total_ignorados}")
-        print(f"   Erros: {total_erros}")
         
         return True
         
@@ -568,25 +995,63 @@ def sincronizar_json_para_banco(nome_arquivo_json: str, session):
         traceback.print_exc()
         return False
 
-def processar_lote_emails(emails_lote: List, llm, prompt_template_json, dados_existentes: Dict, ordens_unicas: Set, nome_arquivo: str, session_db) -> Tuple[int, int, int]:
+def processar_lote_emails(emails_lote: List, chain_extracao, dados_existentes: Dict, ordens_unicas: Set, nome_arquivo: str, session_db, registrar_verificacao: bool = False) -> Tuple[int, int, int, Dict, Set]:
     """Processa um lote de emails em paralelo"""
+    return asyncio.run(processar_lote_emails_async(
+        emails_lote, chain_extracao, dados_existentes, ordens_unicas, nome_arquivo, session_db, registrar_verificacao
+    ))
+
+async def processar_lote_emails_async(emails_lote: List, chain_extracao, dados_existentes: Dict, ordens_unicas: Set, nome_arquivo: str, session_db, registrar_verificacao: bool = False) -> Tuple[int, int, int, Dict, Set]:
+    """Processa um lote de emails com chamadas assíncronas ao Ollama
+    
+    Devolve os contadores do lote junto com dados_existentes e ordens_unicas já
+    atualizados em memória, para o próximo lote não precisar recarregar o JSON.
+    Com registrar_verificacao=True a última verificação é gravada na mesma transação do lote.
+    """
     emails_processados = 0
     emails_duplicados = 0
     emails_atualizados = 0
+    ordens_lote = {}
     
-    for email in emails_lote:
-        corpo = getattr(email, 'Body', '')
-        assunto = getattr(email, 'Subject', 'Sem assunto')
-        data = getattr(email, 'ReceivedTime', datetime.now())
-        remetente = getattr(email, 'SenderEmailAddress', '')
+    # Lê os campos do Outlook uma única vez por e-mail (COM permanece síncrono na thread principal)
+    campos_emails = [
+        (
+            getattr(email, 'Body', ''),
+            getattr(email, 'Subject', 'Sem assunto'),
+            getattr(email, 'ReceivedTime', datetime.now()),
+            getattr(email, 'SenderEmailAddress', '')
+        )
+        for email in emails_lote
+    ]
+    
+    if logger.isEnabledFor(logging.DEBUG):
+        for _, assunto, _, _ in campos_emails:
+            logger.debug("Processando: %s...", assunto[:50])
+    
+    if chain_extracao:
+        emails_ia = [(corpo, assunto) for corpo, assunto, _, _ in campos_emails]
         
-        print(f"{Fore.GREEN}Processando: {assunto[:50]}...{Style.RESET_ALL}")
+        # E-mails com o mesmo assunto e corpo já extraídos não passam pelo Ollama
+        hashes = [_hash_email(corpo, assunto) for corpo, assunto in emails_ia]
+        em_cache = buscar_cache_extracao(session_db, hashes) if session_db else {}
+        indices_pendentes = [i for i, body_hash in enumerate(hashes) if body_hash not in em_cache]
         
-        if llm:
-            dados_exportacao = processar_email_json_rapido(corpo, llm, prompt_template_json, assunto)
-        else:
-            dados_exportacao = {"status": "PROCESSAMENTO_AI_INDISPONIVEL"}
+        extraidos = await processar_emails_json_lote_async(
+            [emails_ia[i] for i in indices_pendentes], chain_extracao
+        )
+        
+        resultados_ia = [em_cache.get(body_hash) for body_hash in hashes]
+        for i, dados in zip(indices_pendentes, extraidos):
+            resultados_ia[i] = dados
         
+        if session_db:
+            salvar_cache_extracao(session_db, {
+                hashes[i]: dados for i, dados in zip(indices_pendentes, extraidos) if not dados.get("erro")
+            }, commit=False)
+    else:
+        resultados_ia = [{"status": "PROCESSAMENTO_AI_INDISPONIVEL"} for _ in campos_emails]
+    
+    for (corpo, assunto, data, remetente), dados_exportacao in zip(campos_emails, resultados_ia):
         # Converte data para string formatada
         if hasattr(data, 'strftime'):
             data_str = data.strftime("%Y-%m-%d %H:%M:%S")
@@ -606,6 +1071,8 @@ def processar_lote_emails(emails_lote: List, llm, prompt_template_json, dados_ex
         
         # Verifica se é uma atualização
         ordem = dados_exportacao.get("Ordem", "").strip()
+        if ordem:
+            ordens_lote.setdefault(ordem)
         if ordem and ordem in ordens_unicas:
             indice_existente, email_existente = encontrar_email_por_ordem(dados_existentes, ordem)
             if indice_existente != -1 and email_existente:
@@ -613,80 +1080,140 @@ def processar_lote_emails(emails_lote: List, llm, prompt_template_json, dados_ex
                 if comparar_datas_email(data_str, data_existente):
                     emails_atualizados += 1
         
-        sucesso, ordens_unicas = salvar_json_incremental_rapido(nome_arquivo, email_processado, ordens_unicas)
+        sucesso, ordens_unicas = salvar_json_incremental_rapido(nome_arquivo, email_processado, ordens_unicas, gravar_disco=False)
         
         if sucesso:
             emails_processados += 1
-            print(f"{Fore.CYAN}✓ Adicionado ({emails_processados}){Style.RESET_ALL}")
-            
-            # Sincroniza com banco de dados após cada inserção
-            if session_db:
-                sincronizar_json_para_banco(nome_arquivo, session_db)
+            logger.debug("✓ Adicionado (%d)", emails_processados)
         else:
             emails_duplicados += 1
     
-    return emails_processados, emails_duplicados, emails_atualizados
+    # Persistência única por lote: UPSERT no banco e depois as linhas do JSONL
+    dados_existentes = carregar_json_existente_rapido(nome_arquivo)
+    lote_confirmado = True
+    
+    if session_db:
+        # Versão já mesclada em memória de todas as ordens lidas no lote, inclusive as que o JSON
+        # tratou como duplicadas: se a transação de um pulso anterior falhou, os mesmos e-mails
+        # voltam a ser lidos e as ordens chegam ao banco mesmo sem nada novo no JSON
+        dados_banco = []
+        for ordem in ordens_lote:
+            _, email_atual = encontrar_email_por_ordem(dados_existentes, ordem)
+            if email_atual:
+                dados_banco.append(email_atual["dados_exportacao"])
+        if dados_banco:
+            lote_confirmado = upsert_registros_sqlite(session_db, montar_registros_banco(dados_banco), commit=False)
+        
+        if lote_confirmado and registrar_verificacao:
+            salvar_ultima_verificacao(session_db, commit=False)
+        
+        # Cache de extração, registros do lote e última verificação confirmados em uma única transação
+        if lote_confirmado:
+            try:
+                session_db.commit()
+            except Exception as e:
+                session_db.rollback()
+                lote_confirmado = False
+                print(f"{Fore.RED}❌ Erro ao gravar lote no banco de dados: {e}{Style.RESET_ALL}")
+    elif registrar_verificacao:
+        salvar_ultima_verificacao()
+    
+    # JSONL só é enviado depois do commit; se o banco falhou as linhas continuam pendentes
+    # em memória e vão junto com o próximo lote confirmado (mesmo que nele só haja duplicados)
+    if lote_confirmado:
+        gravar_json_pendentes(nome_arquivo, ordens_unicas)
+    
+    logger.info("Lote: %d e-mails, %d novos, %d atualizações, %d duplicados",
+                len(campos_emails), emails_processados, emails_atualizados, emails_duplicados)
+    
+    return emails_processados, emails_duplicados, emails_atualizados, dados_existentes, ordens_unicas
 
-def carregar_ultima_verificacao() -> datetime:
+# Arquivo usado antes da tabela meta (e quando o banco não está disponível)
+ARQUIVO_ULTIMA_VERIFICACAO = "ultima_verificacao.json"
+
+def carregar_ultima_verificacao(session_db=None) -> datetime:
     """Carrega a data/hora da última verificação dos e-mails processados."""
-    nome_arquivo = "ultima_verificacao.json"
-    if os.path.exists(nome_arquivo):
-        try:
-            with open(nome_arquivo, "r", encoding="utf-8") as f:
-                dados = json.load(f)
-                valor = dados.get("ultima_verificacao")
-                if valor:
-                    return datetime.fromisoformat(valor)
-        except Exception as e:
-            print(f"{Fore.YELLOW}Erro ao carregar última verificação: {e}{Style.RESET_ALL}")
+    try:
+        valor = None
+        if session_db:
+            valor = session_db.query(MetaDB.value).filter(MetaDB.key == "ultima_verificacao").scalar()
+        
+        if not valor and os.path.exists(ARQUIVO_ULTIMA_VERIFICACAO):
+            # Sem registro no banco: aproveita o arquivo da versão anterior
+            with open(ARQUIVO_ULTIMA_VERIFICACAO, "r", encoding="utf-8") as f:
+                valor = json.load(f).get("ultima_verificacao")
+        
+        if valor:
+            return datetime.fromisoformat(valor)
+    except Exception as e:
+        print(f"{Fore.YELLOW}Erro ao carregar última verificação: {e}{Style.RESET_ALL}")
     # Se não existir, retorna None
     return None
 
-def salvar_ultima_verificacao():
-    """Salva a data/hora da última verificação dos e-mails processados."""
-    nome_arquivo = "ultima_verificacao.json"
+def salvar_ultima_verificacao(session_db=None, commit: bool = True):
+    """Salva a data/hora da última verificação dos e-mails processados.
+    
+    Com commit=False a gravação fica na transação aberta (a do lote).
+    """
+    agora = datetime.now().isoformat()
     try:
-        with open(nome_arquivo, "w", encoding="utf-8") as f:
-            json.dump({"ultima_verificacao": datetime.now().isoformat()}, f, ensure_ascii=False, indent=2)
+        if session_db:
+            stmt = sqlite_insert(MetaDB).values(key="ultima_verificacao", value=agora)
+            stmt = stmt.on_conflict_do_update(index_elements=["key"], set_={"value": stmt.excluded.value})
+            session_db.execute(stmt)
+            if commit:
+                session_db.commit()
+        else:
+            with open(ARQUIVO_ULTIMA_VERIFICACAO, "w", encoding="utf-8") as f:
+                json.dump({"ultima_verificacao": agora}, f, ensure_ascii=False, indent=2)
     except Exception as e:
+        if session_db:
+            session_db.rollback()
         print(f"{Fore.YELLOW}Erro ao salvar última verificação: {e}{Style.RESET_ALL}")
 
-def monitorar_novos_emails_continuamente(outlook, llm, prompt_template_json, nome_arquivo_json, session_db, intervalo_verificacao=60):
+def monitorar_novos_emails_continuamente(outlook, chain_extracao, nome_arquivo_json, session_db, intervalo_verificacao=60):
     """Monitora continuamente por novos emails de exportação"""
     print(f"{Fore.CYAN}🚀 INICIANDO MONITORAMENTO CONTÍNUO...{Style.RESET_ALL}")
     print(f"{Fore.YELLOW}Verificando novos emails a cada {intervalo_verificacao} segundos{Style.RESET_ALL}")
     print(f"{Fore.YELLOW}Pressione Ctrl+C para parar o monitoramento{Style.RESET_ALL}")
     
     try:
+        # Pasta de entrada obtida uma vez e reutilizada em todos os ciclos
+        inbox = outlook.GetDefaultFolder(6)
+        
+        # Dados carregados uma vez; cada lote devolve a versão atualizada em memória
+        dados_existentes = carregar_json_existente_rapido(nome_arquivo_json)
+        ordens_unicas = obter_ordens_unicas_existentes_rapido(nome_arquivo_json)
+        
+        # Acumulado desde o início do monitoramento
+        total_processados = 0
+        total_atualizados = 0
+        
         while True:
-            # Carrega dados atuais
-            dados_existentes = carregar_json_existente_rapido(nome_arquivo_json)
-            ordens_unicas = obter_ordens_unicas_existentes_rapido(nome_arquivo_json)
-            
             # Obtém a última verificação
-            ultima_verificacao = carregar_ultima_verificacao()
+            ultima_verificacao = carregar_ultima_verificacao(session_db)
             
             # Busca novos emails desde a última verificação
-            inbox = outlook.GetDefaultFolder(6)
             novos_emails = obter_emails_exportacao_rapido(inbox, ultima_verificacao)
             
             if novos_emails:
-                print(f"{Fore.GREEN}📨 Novos emails encontrados: {len(novos_emails)}{Style.RESET_ALL}")
+                logger.info("📨 Novos emails encontrados: %d", len(novos_emails))
                 
-                # Processa os novos emails
-                processados, duplicados, atualizados = processar_lote_emails(
-                    novos_emails, llm, prompt_template_json, dados_existentes, ordens_unicas, nome_arquivo_json, session_db
+                # Processa os novos emails; a última verificação é atualizada na transação do lote
+                processados, duplicados, atualizados, dados_existentes, ordens_unicas = processar_lote_emails(
+                    novos_emails, chain_extracao, dados_existentes, ordens_unicas, nome_arquivo_json, session_db,
+                    registrar_verificacao=True
                 )
                 
-                # Atualiza a última verificação
-                salvar_ultima_verificacao()
+                total_processados += processados
+                total_atualizados += atualizados
                 
-                print(f"{Fore.CYAN}📊 Estatísticas desta verificação:{Style.RESET_ALL}")
-                print(f"   Novos processados: {processados}")
-                print(f"   Atualizações: {atualizados}")
-                print(f"   Duplicados: {duplicados}")
+                logger.info("📊 Verificação: %d novos processados, %d atualizações, %d duplicados",
+                            processados, atualizados, duplicados)
             else:
-                print(f"{Fore.BLUE}⏰ Nenhum novo email encontrado. Próxima verificação em {intervalo_verificacao} segundos...{Style.RESET_ALL}")
+                logger.info("⏰ Nenhum novo email encontrado (no monitoramento: %d novos, %d atualizações). "
+                            "Próxima verificação em %d segundos...",
+                            total_processados, total_atualizados, intervalo_verificacao)
             
             # Aguarda o próximo ciclo
             time.sleep(intervalo_verificacao)
@@ -704,7 +1231,8 @@ def pipeline_principal_otimizada(processar_todos: bool = False, modo_monitoramen
     
     # Inicializações otimizadas
     llm = inicializar_ollama()
-    prompt_template_json = criar_template_json() if llm else None
+    # Chain (prompt -> Ollama -> parser) montada uma única vez para todos os lotes
+    chain_extracao = criar_chain_extracao(llm, criar_template_json()) if llm else None
     outlook = inicializar_outlook()
     
     # Inicializa banco de dados
@@ -721,11 +1249,11 @@ def pipeline_principal_otimizada(processar_todos: bool = False, modo_monitoramen
         
         if modo_monitoramento:
             # Modo de monitoramento contínuo
-            monitorar_novos_emails_continuamente(outlook, llm, prompt_template_json, nome_arquivo_json, session_db)
+            monitorar_novos_emails_continuamente(outlook, chain_extracao, nome_arquivo_json, session_db)
         else:
             # Modo de processamento único (comportamento original)
             inbox = outlook.GetDefaultFolder(6)
-            ultima_verificacao = None if processar_todos else carregar_ultima_verificacao()
+            ultima_verificacao = None if processar_todos else carregar_ultima_verificacao(session_db)
             
             print(f"{Fore.YELLOW}Buscando e-mails...{Style.RESET_ALL}")
             emails = obter_emails_exportacao_rapido(inbox, ultima_verificacao)
@@ -745,34 +1273,31 @@ def pipeline_principal_otimizada(processar_todos: bool = False, modo_monitoramen
             total_atualizados = 0
             
             # Processa em lotes para melhor performance
-            tamanho_lote = 5  # Ajuste conforme necessidade
+            tamanho_lote = 50  # Ajuste conforme necessidade (gravação no banco é uma por lote)
             lotes = [emails[i:i + tamanho_lote] for i in range(0, len(emails), tamanho_lote)]
             
             for i, lote in enumerate(lotes, 1):
-                print(f"{Fore.BLUE}Processando lote {i}/{len(lotes)}...{Style.RESET_ALL}")
+                logger.info("Processando lote %d/%d...", i, len(lotes))
                 
-                processados, duplicados, atualizados = processar_lote_emails(
-                    lote, llm, prompt_template_json, dados_existentes, ordens_unicas, nome_arquivo_json, session_db
+                # Última verificação salva na transação do último lote
+                processados, duplicados, atualizados, dados_existentes, ordens_unicas = processar_lote_emails(
+                    lote, chain_extracao, dados_existentes, ordens_unicas, nome_arquivo_json, session_db,
+                    registrar_verificacao=(i == len(lotes))
                 )
                 
                 total_processados += processados
                 total_duplicados += duplicados
                 total_atualizados += atualizados
-                
-                # Atualiza dados existentes após cada lote
-                dados_existentes = carregar_json_existente_rapido(nome_arquivo_json)
-                
-                if i < len(lotes) and llm:
-                    print(f"{Fore.YELLOW}Pausa breve...{Style.RESET_ALL}")
-                    time.sleep(1)
             
-            # Salva última verificação
-            salvar_ultima_verificacao()
+            print(f"\n{Fore.GREEN}✅ PROCESSAMENTO CONCLUÍDO!{Style.RESET_ALL}")
+            if not (total_processados or total_atualizados):
+                # Nada mudou: os totais do JSON são os mesmos do início
+                print(f"{Fore.WHITE}Nenhuma alteração (duplicados ignorados: {total_duplicados}){Style.RESET_ALL}")
+                return
             
-            # Estatísticas finais
-            dados_finais = carregar_json_existente_rapido(nome_arquivo_json)
+            # Estatísticas finais (metadados mantidos em memória a cada lote)
+            dados_finais = dados_existentes
             
-            print(f"\n{Fore.GREEN}✅ PROCESSAMENTO CONCLUÍDO!{Style.RESET_ALL}")
             print(f"{Fore.WHITE}Novos e-mails: {total_processados}")
             print(f"Atualizações: {total_atualizados}")
             print(f"Duplicados ignorados: {total_duplicados}")
@@ -783,150 +1308,53 @@ def pipeline_principal_otimizada(processar_todos: bool = False, modo_monitoramen
     except Exception as e:
         print(f"{Fore.RED}Erro no processamento: {e}{Style.RESET_ALL}")
     finally:
-        # Fecha sessão do banco de dados
+        # Fecha sessão do banco de dados (COM é finalizado no encerramento do processo)
         if session_db:
             session_db.close()
-        
-        if not modo_monitoramento:
-            pythoncom.CoUninitialize()
 
-    def atualizar_planilha_excel_com_banco():
-        """
-        Função para atualizar a planilha Excel com dados do banco de dados
-        """
+def _gravar_planilha_streaming(nome_arquivo_excel: str, nome_aba: str, df: pd.DataFrame):
+    """Grava a planilha de uma única aba com xlsxwriter em constant_memory, uma linha por vez
+    
+    A gravação é feita em um arquivo temporário que substitui o original ao final.
+    """
+    caminho_temp = os.path.splitext(nome_arquivo_excel)[0] + ".tmp.xlsx"
+    wb_destino = xlsxwriter.Workbook(caminho_temp, {
+        'constant_memory': True,
+        'default_date_format': 'dd/mm/yyyy',
+        'nan_inf_to_errors': True
+    })
     try:
-        # Configurações
-        nome_arquivo_excel = "CTNR 07 (1).xlsx"
-        nome_aba = "MINERVA 2.0"
-        nome_tabela = "Tabela1"
-        
-        # Mapeamento de colunas entre banco e Excel
-        mapeamento_colunas = {
-            'data_embarque': 'DT EMBARQUE',
-            'planta_carregamento': 'UNIDADE', 
-            'Tipo_de_embarque': 'TIPO EMBARQUE',
-            'Temperatura': 'TEMPERATURA',
-            'ordem': 'CONTRATO',
-            'porto_saida': 'PORTO SAIDA',
-            'porto_chegada': 'PORTO CHEGADA', 
-            'companhia': 'ARMADOR',
-            'navio': 'NAVIO',
-            'dline': 'DEADLINE',
-            'reserva_booking': 'BOOKING'
-        }
-        
-        print(f"{Fore.CYAN}📊 INICIANDO ATUALIZAÇÃO DA PLANILHA EXCEL{Style.RESET_ALL}")
-        
-        # 1. Conectar ao banco de dados
-        engine_banco = create_engine('sqlite:///data/exportacao.db')
-        Session = sessionmaker(bind=engine_banco)
-        session = Session()
-        
-        # 2. Ler dados do banco
-        query = session.query(ExportacaoDB).all()
-        dados_banco = pd.DataFrame([{
-            'data_embarque': item.data_embarque,
-            'planta_carregamento': item.planta_carregamento,
-            'Tipo_de_embarque': item.tipo_embarque,
-            'Temperatura': item.temperatura,
-            'ordem': item.ordem,
-            'porto_saida': item.porto_saida,
-            'porto_chegada': item.porto_chegada,
-            'companhia': item.companhia,
-            'navio': item.navio,
-            'dline': item.dline,
-            'reserva_booking': item.reserva_booking
-        } for item in query])
-        
-        session.close()
-        
-        if dados_banco.empty:
-            print(f"{Fore.YELLOW}⚠️  Nenhum dado encontrado no banco de dados{Style.RESET_ALL}")
-            return
-        
-        print(f"{Fore.GREEN}✅ Dados do banco carregados: {len(dados_banco)} registros{Style.RESET_ALL}")
-        
-        # 3. Ler a planilha Excel
-        if not os.path.exists(nome_arquivo_excel):
-            print(f"{Fore.RED}❌ Arquivo Excel não encontrado: {nome_arquivo_excel}{Style.RESET_ALL}")
-            return
-        
-        # Ler a aba específica
-        df_excel = pd.read_excel(nome_arquivo_excel, sheet_name=nome_aba)
-        
-        # Verificar se a coluna de ordem (CONTRATO) existe
-        coluna_ordem_excel = mapeamento_colunas['ordem']
-        if coluna_ordem_excel not in df_excel.columns:
-            print(f"{Fore.RED}❌ Coluna '{coluna_ordem_excel}' não encontrada no Excel{Style.RESET_ALL}")
-            return
-        
-        print(f"{Fore.GREEN}✅ Planilha Excel carregada: {len(df_excel)} registros{Style.RESET_ALL}")
-        
-        # 4. Preparar dados para merge
-        # Renomear colunas do banco para os nomes do Excel
-        dados_banco_renomeado = dados_banco.rename(columns=mapeamento_colunas)
-        
-        # Garantir que a coluna de ordem seja string em ambos os DataFrames
-        df_excel[coluna_ordem_excel] = df_excel[coluna_ordem_excel].astype(str)
-        dados_banco_renomeado[coluna_ordem_excel] = dados_banco_renomeado[coluna_ordem_excel].astype(str)
-        
-        # 5. Identificar ordens existentes e novas
-        ordens_excel = set(df_excel[coluna_ordem_excel].dropna().unique())
-        ordens_banco = set(dados_banco_renomeado[coluna_ordem_excel].dropna().unique())
-        
-        ordens_para_atualizar = ordens_excel.intersection(ordens_banco)
-        ordens_para_adicionar = ordens_banco - ordens_excel
-        
-        print(f"{Fore.CYAN}📈 Estatísticas:{Style.RESET_ALL}")
-        print(f"   Ordens no Excel: {len(ordens_excel)}")
-        print(f"   Ordens no Banco: {len(ordens_banco)}")
-        print(f"   Ordens para atualizar: {len(ordens_para_atualizar)}")
-        print(f"   Ordens para adicionar: {len(ordens_para_adicionar)}")
-        
-        # 6. Atualizar registros existentes
-        if ordens_para_atualizar:
-            print(f"{Fore.YELLOW}🔄 Atualizando registros existentes...{Style.RESET_ALL}")
-            
-            # Filtrar dados do banco que existem no Excel
-            dados_para_atualizar = dados_banco_renomeado[
-                dados_banco_renomeado[coluna_ordem_excel].isin(ordens_para_atualizar)
-            ]
-            
-            # Remover registros antigos do Excel
-            df_excel = df_excel[~df_excel[coluna_ordem_excel].isin(ordens_para_atualizar)]
-            
-            # Adicionar dados atualizados
-            df_excel = pd.concat([df_excel, dados_para_atualizar], ignore_index=True)
-            
-            print(f"{Fore.GREEN}✅ {len(dados_para_atualizar)} registros atualizados{Style.RESET_ALL}")
-        
-        # 7. Adicionar novos registros
-        if ordens_para_adicionar:
-            print(f"{Fore.BLUE}➕ Adicionando novos registros...{Style.RESET_ALL}")
-            
-            # Filtrar dados do banco que não existem no Excel
-            dados_para_adicionar = dados_banco_renomeado[
-                dados_banco_renomeado[coluna_ordem_excel].isin(ordens_para_adicionar)
-            ]
-            
-            # Adicionar novos dados ao Excel
-            df_excel = pd.concat([df_excel, dados_para_adicionar], ignore_index=True)
-            
-            print(f"{Fore.GREEN}✅ {len(dados_para_adicionar)} novos registros adicionados{Style.RESET_ALL}")
-        
-        # 8. Salvar a planilha atualizada
-        # Usar ExcelWriter para preservar outras abas e formatações
-        with pd.ExcelWriter(nome_arquivo_excel, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-            df_excel.to_excel(writer, sheet_name=nome_aba, index=False)
-        
-        print(f"{Fore.GREEN}🎯 Planilha atualizada com sucesso!{Style.RESET_ALL}")
-        print(f"{Fore.CYAN}📊 Total de registros na planilha: {len(df_excel)}{Style.RESET_ALL}")
-        
-        return True
-        
-    except Exception as e:
-        print(f"{Fore.RED}❌ Erro ao atualizar planilha: {e}{Style.RESET_ALL}")
-        return False
+        ws = wb_destino.add_worksheet(nome_aba)
+        # NaN/NaT viram células vazias
+        linhas = itertools.chain(
+            [list(df.columns)],
+            df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+        )
+        for i, linha in enumerate(linhas):
+            ws.write_row(i, 0, linha)
+    finally:
+        wb_destino.close()
+    
+    os.replace(caminho_temp, nome_arquivo_excel)
+
+def _gravar_aba_planilha(nome_arquivo_excel: str, nome_aba: str, df: pd.DataFrame):
+    """Substitui a aba alvo da planilha pelo DataFrame
+    
+    Com outras abas no arquivo a gravação fica com o openpyxl (mode='a', if_sheet_exists='replace'),
+    que mantém fórmulas, formatos, larguras e nomes definidos delas; sem nada a preservar a aba
+    é gravada em streaming pelo xlsxwriter.
+    """
+    outras_abas = []
+    if os.path.exists(nome_arquivo_excel):
+        with pd.ExcelFile(nome_arquivo_excel, engine='calamine') as xls:
+            outras_abas = [aba for aba in xls.sheet_names if aba != nome_aba]
+    
+    if not outras_abas:
+        _gravar_planilha_streaming(nome_arquivo_excel, nome_aba, df)
+        return
+    
+    with pd.ExcelWriter(nome_arquivo_excel, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
+        df.to_excel(writer, sheet_name=nome_aba, index=False)
 
 def atualizar_planilha_avancado():
     """
@@ -952,77 +1380,64 @@ def atualizar_planilha_avancado():
         }
         
         # 1. Ler dados do banco
-        engine = create_engine('sqlite:///data/exportacao.db')
+        engine = criar_engine_banco()
         query = "SELECT * FROM dbCONTAINER"
-        dados_banco = pd.read_sql(query, engine)
+        with engine.begin() as conn:
+            # Colunas Arrow desde a leitura: filtros e isin não passam por objetos Python
+            dados_banco = pd.read_sql_query(query, conn, dtype_backend='pyarrow')
         
         if dados_banco.empty:
             print(f"{Fore.YELLOW}⚠️  Nenhum dado no banco{Style.RESET_ALL}")
             return
         
-        # 2. Ler Excel preservando formatação
-        with pd.ExcelFile(nome_arquivo_excel, engine='openpyxl') as xls:
-            df_excel = pd.read_excel(xls, sheet_name=nome_aba)
-            
-            # Preservar outras abas
-            outras_abas = {sheet: pd.read_excel(xls, sheet_name=sheet) 
-                          for sheet in xls.sheet_names if sheet != nome_aba}
-        
         coluna_ordem = mapeamento['ordem']
         
+        # 2. Ler apenas a aba alvo com o calamine (as outras abas não são carregadas)
+        df_excel = pd.read_excel(
+            nome_arquivo_excel, sheet_name=nome_aba, engine='calamine',
+            dtype={coluna_ordem: 'string[pyarrow]'}
+        )
+        
         # 3. Merge avançado usando pandas
         # Preparar dados
         dados_banco_preparados = (dados_banco
             .rename(columns=mapeamento)
-            .astype({coluna_ordem: str})
+            .astype({coluna_ordem: 'string[pyarrow]'})
             .drop_duplicates(subset=[coluna_ordem])
         )
         
-        df_excel[coluna_ordem] = df_excel[coluna_ordem].astype(str)
-        
-        # 4. Fazer merge para identificar ações necessárias
-        merge_info = pd.merge(
-            df_excel[[coluna_ordem]], 
-            dados_banco_preparados[[coluna_ordem]], 
-            on=coluna_ordem, 
-            how='outer', 
-            indicator=True
-        )
+        # 4. Índices das ordens de cada lado (sem materializar um merge)
+        idx_excel = pd.Index(df_excel[coluna_ordem].unique())
+        idx_banco = pd.Index(dados_banco_preparados[coluna_ordem].unique())
         
         # 5. Separar em diferentes ações
-        apenas_excel = merge_info[merge_info['_merge'] == 'left_only'][coluna_ordem]
-        apenas_banco = merge_info[merge_info['_merge'] == 'right_only'][coluna_ordem]
-        em_ambos = merge_info[merge_info['_merge'] == 'both'][coluna_ordem]
+        apenas_excel = idx_excel.difference(idx_banco)
+        apenas_banco = idx_banco.difference(idx_excel)
+        em_ambos = idx_excel.intersection(idx_banco)
         
-        # 6. Processar cada caso
+        # 6. Processar cada caso (partes concatenadas uma única vez no fim)
         # Manter dados que só existem no Excel
-        df_final = df_excel[df_excel[coluna_ordem].isin(apenas_excel)]
+        partes = [df_excel[df_excel[coluna_ordem].isin(apenas_excel)]]
         
         # Atualizar dados que existem em ambos
         if not em_ambos.empty:
-            dados_atualizados = dados_banco_preparados[
+            partes.append(dados_banco_preparados[
                 dados_banco_preparados[coluna_ordem].isin(em_ambos)
-            ]
-            df_final = pd.concat([df_final, dados_atualizados], ignore_index=True)
+            ])
         
         # Adicionar dados que só existem no banco
         if not apenas_banco.empty:
-            dados_novos = dados_banco_preparados[
+            partes.append(dados_banco_preparados[
                 dados_banco_preparados[coluna_ordem].isin(apenas_banco)
-            ]
-            df_final = pd.concat([df_final, dados_novos], ignore_index=True)
+            ])
+        
+        df_final = pd.concat(partes, ignore_index=True)
         
         # 7. Ordenar por ordem (contrato)
-        df_final = df_final.sort_values(by=coluna_ordem).reset_index(drop=True)
+        df_final = df_final.sort_values(by=coluna_ordem, ignore_index=True, kind='quicksort')
         
-        # 8. Salvar preservando outras abas
-        with pd.ExcelWriter(nome_arquivo_excel, engine='openpyxl') as writer:
-            # Salvar aba principal atualizada
-            df_final.to_excel(writer, sheet_name=nome_aba, index=False)
-            
-            # Salvar outras abas
-            for sheet_name, sheet_data in outras_abas.items():
-                sheet_data.to_excel(writer, sheet_name=sheet_name, index=False)
+        # 8. Salvar substituindo só a aba principal (outras abas preservadas com fórmulas e formatos)
+        _gravar_aba_planilha(nome_arquivo_excel, nome_aba, df_final)
         
         print(f"{Fore.GREEN}✅ Planilha atualizada com sucesso!{Style.RESET_ALL}")
         print(f"{Fore.CYAN}📊 Estatísticas:{Style.RESET_ALL}")
@@ -1061,6 +1476,8 @@ def atualizar_excel_manual():
     return atualizar_planilha_avancado()
 
 if __name__ == "__main__":
+    configurar_log()
+    
     # Medição de tempo
     inicio = time.time()
     # Para modo contínuo, use: pipeline_principal_otimizada(modo_monitoramento=True)